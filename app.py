@@ -8,29 +8,170 @@ from flask import (
     abort,
     jsonify,
     url_for,
+    g,
+    current_app,
+    Response,
+    has_request_context,
 )
+from flask.json.provider import DefaultJSONProvider
 import secrets
-from functools import wraps
+from collections.abc import Mapping
+from functools import lru_cache, wraps
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
-from datetime import timedelta, datetime
+from google.api_core.exceptions import NotFound
+from datetime import timedelta, datetime, timezone
 import os
 import re
+import time
 from dotenv import load_dotenv
 from services.bright_data import BrightDataService
 
+import asyncio
+import atexit
+import hashlib
+import hmac
+import io
+import json
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 
-# Configure logging to go to stdout/stderr for Railway
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)  # Send to stdout for Railway
-    ],
-    force=True  # Override any existing configuration
-)
+import httpx
+import openai
+import orjson
+import psutil
+import razorpay
+import requests
+import tiktoken
+from requests.adapters import HTTPAdapter
+from cachetools import TTLCache
+from flask_cors import CORS
+from urllib3.util.retry import Retry
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler that writes through an 8 KB buffer instead of one write() per record.
+
+    Records below WARNING stay in the buffer until someone calls flush(), so a
+    batch handed over by the MemoryHandler goes out in a single syscall.
+    """
+
+    def __init__(self, fileno, buffer_size=8192):
+        raw = io.FileIO(fileno, "w", closefd=False)
+        stream = io.TextIOWrapper(
+            io.BufferedWriter(raw, buffer_size=buffer_size),
+            encoding="utf-8",
+            write_through=False,
+        )
+        super().__init__(stream)
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.WARNING:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class TimedMemoryHandler(logging.handlers.MemoryHandler):
+    """MemoryHandler that also flushes at most `flush_interval` seconds after a record arrives.
+
+    Without this, a quiet worker could hold INFO records in memory until the
+    buffer fills up.
+    """
+
+    def __init__(self, *args, flush_interval=1.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flush_interval = flush_interval
+        self._flush_timer = None
+
+    def emit(self, record):
+        super().emit(record)
+        if self.buffer and self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            super().flush()
+            if self.target:
+                self.target.flush()
+
+
+def configure_logging():
+    """Send log records through a queue so request threads never block on stdout.
+
+    The real StreamHandler lives behind a QueueListener running in its own
+    thread; request threads only pay for an in-memory queue put.
+
+    Safe to call more than once (serverless platforms may re-import the
+    module): the existing listener is reused instead of stacking handlers.
+    """
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers:
+        if getattr(handler, "listener", None) is not None:
+            return handler.listener
+
+    # None of these record attributes are in our format; skip collecting them per record
+    # (_srcfile = None turns off the stack walk for pathname/lineno/funcName)
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+    logging._srcfile = None
+
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = BufferedStreamHandler(sys.stdout.fileno())  # Send to stdout for Railway
+    stream_handler.setFormatter(
+        logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%dT%H:%M:%S',
+        )
+    )
+
+    # Batch records in memory so stdout is written in bursts; ERROR and above flush at once,
+    # everything else within a second
+    memory_handler = TimedMemoryHandler(
+        capacity=256,
+        flushLevel=logging.ERROR,
+        target=stream_handler,
+        flushOnClose=True,
+    )
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # The listener's handler does the real formatting, keep only the message here
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    root_logger.handlers.clear()  # Override any existing configuration
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(logging.INFO)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, memory_handler, respect_handler_level=True
+    )
+    listener.start()
+    queue_handler.listener = listener
+    # atexit runs in reverse order: stop the listener first, then flush the buffer
+    atexit.register(memory_handler.close)
+    # Drain whatever is still queued when the worker exits (gunicorn exits via sys.exit on SIGTERM)
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
 # Make sure print statements are flushed immediately
@@ -40,29 +181,51 @@ try:
 except:
     pass  # Some Python versions don't support reconfigure
 
-# Helper function to ensure logs appear in Railway
-def log_print(*args, **kwargs):
-    """Print that also logs and flushes immediately"""
-    message = ' '.join(str(arg) for arg in args)
-    logger.info(message)
-    print(*args, **kwargs, flush=True)
+load_dotenv()
 
-# Initialize BrightData service
+# Initialize BrightData service (after load_dotenv, it reads its config once)
 bright_data_service = BrightDataService()
-import openai
-import razorpay
-import json
-import hmac
-import hashlib
-import requests
-from flask_cors import CORS
-from dateutil.relativedelta import relativedelta
 
-load_dotenv()
+# One event loop for the async helpers, running in a background thread, instead of
+# asyncio.run creating and tearing down a loop on every request
+event_loop = asyncio.new_event_loop()
+threading.Thread(target=event_loop.run_forever, name="asyncio-loop", daemon=True).start()
+
+
+def run_async(coro):
+    """Run `coro` on the shared event loop and wait for its result.
+
+    The coroutine gets a copy of the caller's context variables, so Flask's request
+    context (session, g) is still available inside it.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, event_loop).result()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, used by request.get_json() and jsonify.
+
+    Types orjson doesn't handle itself go through Flask's default encoder; datetimes
+    are passed through too, so they keep Flask's HTTP date format.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+app.extensions["log_listener"] = log_listener
+
+# Pages and their scripts are served from this app, so CORS is only needed when
+# another origin calls the API; skip the per-request hook otherwise
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "")
+if CORS_ORIGINS:
+    CORS(app, resources={r"/api/*": {"origins": [o.strip() for o in CORS_ORIGINS.split(",")]}})
 app.secret_key = os.getenv("SECRET_KEY")
 
 # Add request logging middleware for Railway - logs all HTTP requests
@@ -73,9 +236,7 @@ def log_request_info():
     if request.path.startswith('/static/'):
         return
     
-    log_msg = f"[HTTP REQUEST] {request.method} {request.path} - IP: {request.remote_addr}"
-    logger.info(log_msg)
-    print(log_msg, flush=True)
+    logger.info("[HTTP REQUEST] %s %s - IP: %s", request.method, request.path, request.remote_addr)
 
 @app.after_request
 def log_response_info(response):
@@ -84,11 +245,16 @@ def log_response_info(response):
     if request.path.startswith('/static/'):
         return response
     
-    log_msg = f"[HTTP RESPONSE] {request.method} {request.path} - Status: {response.status_code}"
-    logger.info(log_msg)
-    print(log_msg, flush=True)
+    logger.info("[HTTP RESPONSE] %s %s - Status: %s", request.method, request.path, response.status_code)
     return response
 
+@app.teardown_request
+def flush_logs_on_error(exc):
+    """Flush buffered log records when a request dies with an uncaught exception"""
+    if exc is not None:
+        for handler in log_listener.handlers:
+            handler.flush()
+
 # Configure session cookie settings
 app.config["SESSION_COOKIE_SECURE"] = True  # Ensure cookies are sent over HTTPS
 app.config["SESSION_COOKIE_HTTPONLY"] = True  # Prevent JavaScript access to cookies
@@ -98,35 +264,87 @@ app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(
 app.config["SESSION_REFRESH_EACH_REQUEST"] = True
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"  # Can be 'Strict', 'Lax', or 'None'
 
-# API Keys and Configuration
+# API Keys and Configuration (read once here, not per request)
 openai.api_key = os.getenv("OPENAI_API_KEY")
+YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+
+# Shared session so YouTube Data API calls reuse keep-alive connections
+# instead of a new TCP + TLS handshake each time
+youtube_http = requests.Session()
+youtube_http.mount(
+    "https://",
+    HTTPAdapter(pool_maxsize=10, max_retries=Retry(total=2, backoff_factor=0.2)),
+)
 
 # Razorpay Configuration
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+# (connect, read) seconds; bounds how long a checkout can hold one of the worker threads
+RAZORPAY_TIMEOUT = (3, 10)
 
 # Firebase Admin SDK setup
-firebase_credentials = {
-    "type": "service_account",
-    "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-    "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-    "private_key": (os.getenv("FIREBASE_PRIVATE_KEY").replace("\\n", "\n")),
-    "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-    "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-    "token_uri": "https://oauth2.googleapis.com/token",
-    "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-    "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_CERT_URL"),
-    "universe_domain": "googleapis.com",
-}
+def init_firebase(env):
+    """Initialize the Admin SDK from FIREBASE_* variables and return a Firestore client"""
+    cred = credentials.Certificate(
+        {
+            "type": "service_account",
+            "project_id": env.get("FIREBASE_PROJECT_ID"),
+            "private_key_id": env.get("FIREBASE_PRIVATE_KEY_ID"),
+            "private_key": env["FIREBASE_PRIVATE_KEY"].replace("\\n", "\n"),
+            "client_email": env.get("FIREBASE_CLIENT_EMAIL"),
+            "client_id": env.get("FIREBASE_CLIENT_ID"),
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+            "client_x509_cert_url": env.get("FIREBASE_CLIENT_CERT_URL"),
+            "universe_domain": "googleapis.com",
+        }
+    )
+    firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+
+# One client per process: it keeps its own gRPC connection pool and is safe to use
+# concurrently. Created at import, in each worker: gunicorn is deliberately not run
+# with --preload, as gRPC channels and the event loop thread do not survive fork.
+db = init_firebase(os.environ)
+app.extensions["firestore"] = db
+
+
+def get_db():
+    """Return the process-wide Firestore client.
+
+    The client maintains its own internal gRPC connection pool and allows its
+    methods to be called concurrently, so routes must share this instance
+    rather than creating their own.
+    """
+    return current_app.extensions["firestore"]
+
+
+def get_documents(*refs):
+    """Fetch several documents in one BatchGetDocuments RPC, returned in argument order"""
+    snapshots = {snapshot.reference.path: snapshot for snapshot in get_db().get_all(refs)}
+    return [snapshots[ref.path] for ref in refs]
+
+
+def warm_up_firestore(client):
+    """Open the gRPC channel (DNS, TLS, token fetch) before the first request needs it"""
+    try:
+        client.collection("_warmup").limit(1).get(retry=None, timeout=5)
+    except Exception as e:
+        logger.warning("Firestore warm-up failed: %s", e)
+
+
+# Credentials and the client are set up synchronously above (cheap, and a bad config
+# should fail at boot); only the network-bound warm-up runs off the import path
+threading.Thread(
+    target=warm_up_firestore, args=(db,), name="firestore-warmup", daemon=True
+).start()
 
-cred = credentials.Certificate(firebase_credentials)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
 
 # Define subscription plans
-SUBSCRIPTION_PLANS = {
+SUBSCRIPTION_PLANS = MappingProxyType({
     "free": {
         "name": "Free Plan",
         "minutes_limit": 30,  # 30 minutes per month
@@ -153,19 +371,68 @@ SUBSCRIPTION_PLANS = {
             "Premium Support",
         ],
     },
+})
+
+# Monthly minute limit per plan, for the usage checks
+PLAN_LIMITS = MappingProxyType(
+    {plan_id: plan["minutes_limit"] for plan_id, plan in SUBSCRIPTION_PLANS.items()}
+)
+
+
+@lru_cache(maxsize=64)
+def _error_body(message):
+    return json.dumps({"error": message}).encode("utf-8")
+
+
+def error_response(message, status):
+    """JSON error response whose body is serialized once per (constant) message.
+
+    A fresh Response is built each time because after_request hooks mutate it.
+    """
+    return Response(_error_body(message), status=status, mimetype="application/json")
+
+
+INVALID_WEBHOOK_SOURCE_BODY = json.dumps(
+    {"status": "error", "message": "Invalid webhook source"}
+).encode("utf-8")
+
+
+HTTP_ERROR_MESSAGES = {
+    400: "Bad request",
+    403: "Forbidden",
+    404: "Resource not found",
+    500: "Internal server error",
 }
 
 
+def handle_http_error(error):
+    """Single handler for the common HTTP errors: JSON for /api/*, Flask's default page otherwise"""
+    code = getattr(error, "code", 500)
+    if code < 500:
+        # 5xx are already logged with their traceback by Flask
+        logger.warning("%d error: %s", code, error)
+    if request.path.startswith("/api/"):
+        return error_response(HTTP_ERROR_MESSAGES[code], code)
+    return error
+
+
+for _code in HTTP_ERROR_MESSAGES:
+    app.register_error_handler(_code, handle_http_error)
+
+
 ########################################
 """ Authentication and Authorization """
 
-import psutil
-import os
+# Handle on this worker process for log_memory_usage. The module is imported in each
+# worker (gunicorn runs without --preload), so this is the worker's own pid.
+_PROCESS = psutil.Process()
+
 
 def log_memory_usage(stage):
-    process = psutil.Process(os.getpid())
-    mem_info = process.memory_info()
-    print(f"[{stage}] Memory usage: {mem_info.rss / (1024 * 1024):.2f} MB")
+    """Log the worker's resident memory; only measured when DEBUG logging is on"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[%s] Memory usage: %.2f MB", stage, _PROCESS.memory_info().rss / (1024 * 1024))
+
 # Decorator for routes that require authentication
 def auth_required(f):
     @wraps(f)
@@ -180,6 +447,18 @@ def auth_required(f):
     return decorated_function
 
 
+# (minutes_used_this_month, plan) per user for plan_checker, so the limit check on every
+# /summarize does not need a Firestore read. Updated locally when usage or the plan
+# changes in this process. TTLCache is not thread-safe, hence the lock.
+USAGE_CACHE = TTLCache(maxsize=10000, ttl=300)
+USAGE_CACHE_LOCK = threading.Lock()
+
+# Subscription per user for load_plan_data, which runs on nearly every page render.
+# Only update_user_subscription changes it, and that evicts the entry.
+SUBSCRIPTION_CACHE = TTLCache(maxsize=10000, ttl=300)
+SUBSCRIPTION_CACHE_LOCK = threading.Lock()
+
+
 # Decorator to check if user has enough minutes in their plan
 def plan_checker(f):
     @wraps(f)
@@ -188,19 +467,24 @@ def plan_checker(f):
             return redirect(url_for("login"))
 
         user_id = session["user"]["uid"]
-        # Get user subscription and usage data
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
+        with USAGE_CACHE_LOCK:
+            cached_usage = USAGE_CACHE.get(user_id)
 
-        if not user_doc.exists:
-            # Set up default free plan for new users
-            initialize_new_user(user_id)
-            user_doc = user_ref.get()
+        if cached_usage is None:
+            # Get user subscription and usage data (sets up the free plan for new users)
+            _, user_data = get_user_fields(
+                user_id, ["subscription.plan", "usage.minutes_used_this_month"]
+            )
+            cached_usage = (
+                user_data.get("usage", {}).get("minutes_used_this_month", 0),
+                user_data.get("subscription", {}).get("plan", "free"),
+            )
+            with USAGE_CACHE_LOCK:
+                USAGE_CACHE[user_id] = cached_usage
 
-        user_data = user_doc.to_dict()
-        plan_type = user_data.get("subscription", {}).get("plan", "free")
-        usage_minutes = user_data.get("usage", {}).get("minutes_used_this_month", 0)
-        plan_limit = SUBSCRIPTION_PLANS[plan_type]["minutes_limit"]
+        g.usage = cached_usage  # Lets the view skip reading the user doc again
+        usage_minutes, plan_type = cached_usage
+        plan_limit = PLAN_LIMITS[plan_type]
 
         if usage_minutes >= plan_limit:
             return (
@@ -221,32 +505,222 @@ def plan_checker(f):
     return decorated_function
 
 
-# Function to initialize a new user with default settings
+# Midnight on the first of the month after (year, month); the same for every
+# user who signs up or upgrades that month
+@lru_cache(maxsize=2)
+def first_of_next_month(year, month):
+    return datetime(year + month // 12, month % 12 + 1, 1)
+
+
+# Function to initialize a new user with default settings. Background work (the
+# webhook) has no session, so the email is only looked up within a request.
 def initialize_new_user(user_id):
-    today = datetime.now()
-    next_month = today + relativedelta(
-        months=1, day=1, hour=0, minute=0, second=0, microsecond=0
-    )
+    email = session.get("user", {}).get("email", "unknown") if has_request_context() else "unknown"
+    today = datetime.utcnow()
+    next_month = first_of_next_month(today.year, today.month)
 
     user_data = {
         "subscription": {
             "plan": "free",
-            "start_date": today,
+            "start_date": firestore.SERVER_TIMESTAMP,
             "next_billing_date": next_month,
             "status": "active",
         },
         "usage": {
             "minutes_used_this_month": 0,
             "reset_date": next_month,
-            "video_history": [],
+            "video_count": 0,
         },
         "profile": {
-            "created_at": today,
-            "email": session.get("user", {}).get("email", "unknown"),
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "email": email,
         },
     }
 
-    db.collection("users").document(user_id).set(user_data)
+    get_db().collection("users").document(user_id).set(user_data)
+    return user_data
+
+
+def get_user_doc(user_id):
+    """Return (user_ref, user_data), reading Firestore at most once per request.
+
+    user_data is None when the user document does not exist.
+    """
+    cached = g.get("user_doc")
+    if cached is not None and cached[0].id == user_id:
+        return cached
+    user_ref = get_db().collection("users").document(user_id)
+    snapshot = user_ref.get()
+    user_data = snapshot.to_dict() if snapshot.exists else None
+    if user_data is not None and "video_history" in user_data.get("usage", {}):
+        video_history = user_data["usage"].pop("video_history")
+        user_data["usage"]["video_count"] = migrate_video_history(user_ref, video_history)
+    g.user_doc = (user_ref, user_data)
+    return g.user_doc
+
+
+def get_or_create_user_doc(user_id):
+    """Like get_user_doc, but sets up a new user with the free plan if needed"""
+    user_ref, user_data = get_user_doc(user_id)
+    if user_data is None:
+        user_data = initialize_new_user(user_id)
+        g.user_doc = (user_ref, user_data)
+    return user_ref, user_data
+
+
+def get_user_fields(user_id, field_paths):
+    """Return (user_ref, user_data) with only `field_paths` read from Firestore.
+
+    Keeps per-request reads small. Reuses the full document if this request already
+    loaded it, and sets up new users like get_or_create_user_doc.
+    """
+    cached = g.get("user_doc")
+    if cached is not None and cached[0].id == user_id:
+        return cached
+    user_ref = get_db().collection("users").document(user_id)
+    # usage.video_history only exists for users who haven't been migrated yet
+    snapshot = user_ref.get(field_paths=[*field_paths, "usage.video_history"])
+    if not snapshot.exists:
+        return get_or_create_user_doc(user_id)
+    user_data = snapshot.to_dict()
+    if "video_history" in user_data.get("usage", {}):
+        # Loading the full document migrates their history and sets the count
+        return get_user_doc(user_id)
+    return user_ref, user_data
+
+
+def migrate_video_history(user_ref, video_history):
+    """Move a legacy usage.video_history array into the users/{uid}/videos subcollection.
+
+    Returns the user's video count afterwards.
+    """
+    videos_ref = user_ref.collection("videos")
+    # update_user_usage writes to the subcollection without reading the user first,
+    # so videos processed since the deploy may already be there, and are newer
+    existing_ids = {doc.id for doc in videos_ref.select(["__name__"]).stream()}  # Ids only
+    # The array is oldest first, so a re-processed video keeps its latest entry. Dedupe
+    # up front: BulkWriter sends writes in parallel with no ordering between them.
+    latest_entries = {entry["video_id"]: entry for entry in video_history}
+    bulk_writer = get_db().bulk_writer()
+    for video_id, entry in latest_entries.items():
+        if video_id not in existing_ids:
+            bulk_writer.set(videos_ref.document(video_id), entry)
+    bulk_writer.close()  # Flushes and waits for every write
+    video_count = len(existing_ids | latest_entries.keys())
+    user_ref.update(
+        {
+            "usage.video_history": firestore.DELETE_FIELD,
+            "usage.video_count": video_count,
+        }
+    )
+    logger.info("Migrated %d history entries for user %s", len(latest_entries), user_ref.id)
+    return video_count
+
+
+def get_video_history(user_id, limit, before=None):
+    """Return the user's most recently processed videos, newest first.
+
+    `before` is a processed_at datetime to page past.
+    """
+    query = (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("videos")
+        .order_by("processed_at", direction=firestore.Query.DESCENDING)
+    )
+    if before is not None:
+        query = query.start_after({"processed_at": before})
+    return [snapshot.to_dict() for snapshot in query.limit(limit).stream()]
+
+
+# Current year for the footer, refreshed at most once an hour
+_YEAR_CACHE = [datetime.now().year, time.time()]
+
+
+def current_year():
+    if time.time() - _YEAR_CACHE[1] > 3600:
+        _YEAR_CACHE[0] = datetime.now().year
+        _YEAR_CACHE[1] = time.time()
+    return _YEAR_CACHE[0]
+
+
+class LazyProxy(Mapping):
+    """Read-only mapping that only calls `loader` the first time it is accessed"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __str__(self):
+        return str(self._load())
+
+
+# Subscription data for the logged-in user, read from Firestore at most once per request
+# and shared across requests through SUBSCRIPTION_CACHE
+def load_plan_data():
+    if "plan_data" not in g:
+        plan_data = {"plan": "free"}
+        if "user" in session:
+            user_id = session["user"]["uid"]
+            cached = g.get("user_doc")
+            with SUBSCRIPTION_CACHE_LOCK:
+                cached_plan = SUBSCRIPTION_CACHE.get(user_id)
+            if cached_plan is not None:
+                user_data = {"subscription": cached_plan}
+            elif cached is not None and cached[0].id == user_id:
+                user_data = cached[1]
+            else:
+                # Only the subscription is needed here, not the whole document
+                snapshot = (
+                    get_db()
+                    .collection("users")
+                    .document(user_id)
+                    .get(field_paths=["subscription"])
+                )
+                user_data = snapshot.to_dict() if snapshot.exists else None
+            if user_data is not None:
+                plan_data = user_data.get("subscription", {"plan": "free"})
+                with SUBSCRIPTION_CACHE_LOCK:
+                    SUBSCRIPTION_CACHE[user_id] = plan_data
+        g.plan_data = plan_data
+    return g.plan_data
+
+
+def is_authenticated():
+    """Whether the current request has a logged-in user, evaluated once per request"""
+    if "is_authenticated" not in g:
+        g.is_authenticated = "user" in session
+    return g.is_authenticated
+
+
+# Template variables that never change; copied into every render's context
+_BASE_TEMPLATE_CTX = {"plans": SUBSCRIPTION_PLANS}
+
+
+@app.context_processor
+def inject_template_vars():
+    """Default template variables; values passed to render_template take precedence"""
+    ctx = _BASE_TEMPLATE_CTX.copy()
+    ctx["is_authenticated"] = is_authenticated()
+    # Templates that never touch plan_data never pay for the Firestore read
+    ctx["plan_data"] = LazyProxy(load_plan_data)
+    ctx["current_year"] = current_year()
+    return ctx
 
 
 @app.route("/")
@@ -295,52 +769,28 @@ def signup():
 
 @app.route("/terms")
 def terms():
-    is_authenticated = "user" in session
-    
-    # Default values for non-authenticated users
-    plan_data = {"plan": "free"}
-    
-    # If user is authenticated, get their plan data
-    if is_authenticated:
-        user_id = session["user"]["uid"]
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            plan_data = user_data.get("subscription", {"plan": "free"})
-    
-    return render_template(
-        "terms.html", 
-        is_authenticated=is_authenticated,
-        plan_data=plan_data,
-        plans=SUBSCRIPTION_PLANS
-    )
+    # is_authenticated, plan_data and plans come from inject_template_vars
+    return render_static_page("terms.html")
 
 
 @app.route("/privacy")
 def privacy():
-    is_authenticated = "user" in session
-    
-    # Default values for non-authenticated users
-    plan_data = {"plan": "free"}
-    
-    # If user is authenticated, get their plan data
-    if is_authenticated:
-        user_id = session["user"]["uid"]
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            plan_data = user_data.get("subscription", {"plan": "free"})
-    
-    return render_template(
-        "privacy.html", 
-        is_authenticated=is_authenticated,
-        plan_data=plan_data,
-        plans=SUBSCRIPTION_PLANS
-    )
+    # is_authenticated, plan_data and plans come from inject_template_vars
+    return render_static_page("privacy.html")
+
+
+def render_static_page(template):
+    """Render a page whose content only varies with login state.
+
+    Logged-out visitors all get the same page, so browsers and CDNs may keep it for
+    an hour. Reading the session adds Vary: Cookie, so logged-in users never get the
+    shared copy.
+    """
+    response = make_response(render_template(template))
+    if not is_authenticated():
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+    return response
 
 
 @app.route("/reset-password")
@@ -363,42 +813,47 @@ def logout():
 """ Private Routes (Require authorization) """
 
 
-@app.route("/dashboard")
-@auth_required
-def dashboard():
-    user_id = session["user"]["uid"]
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        initialize_new_user(user_id)
-        user_doc = user_ref.get()
-
-    user_data = user_doc.to_dict()
-
-    # Format the data for the template
+def build_plan_data(user_data):
+    """Plan and usage figures shown on the dashboard and by /api/user-usage"""
+    subscription = user_data.get("subscription", {})
+    plan_type = subscription.get("plan", "free")
     minutes_used = user_data.get("usage", {}).get("minutes_used_this_month", 0)
-    plan_type = user_data.get("subscription", {}).get("plan", "free")
-    minutes_limit = SUBSCRIPTION_PLANS[plan_type]["minutes_limit"]
-    
-    # Calculate percentage used - ensure it's a valid number to prevent display issues
-    percentage_used = 0
-    if minutes_limit > 0:
+    minutes_limit = PLAN_LIMITS[plan_type]
+
+    # Share of the monthly limit used, rounded to one decimal; 0 when nothing is used
+    if not minutes_used or minutes_limit <= 0:
+        percentage_used = 0
+    else:
         percentage_used = round((minutes_used / minutes_limit) * 100, 1)
-    
-    plan_data = {
+
+    return {
         "plan": plan_type,
         "minutes_used": minutes_used,
         "minutes_limit": minutes_limit,
         "percentage_used": percentage_used,
-        "next_billing_date": user_data.get("subscription", {})
-        .get("next_billing_date", datetime.now())
-        .strftime("%B %d, %Y"),
-        "recent_videos": user_data.get("usage", {}).get("video_history", [])[
-            :3
-        ],  # Get last 5 videos
+        "next_billing_date": subscription.get(
+            "next_billing_date", datetime.utcnow()
+        ).strftime("%B %d, %Y"),
     }
 
+
+@app.route("/dashboard")
+@auth_required
+def dashboard():
+    user_id = session["user"]["uid"]
+    _, user_data = get_user_fields(
+        user_id,
+        [
+            "subscription.plan",
+            "subscription.next_billing_date",
+            "usage.minutes_used_this_month",
+        ],
+    )
+
+    # Format the data for the template
+    plan_data = build_plan_data(user_data)
+    plan_data["recent_videos"] = get_video_history(user_id, 3)
+
     return render_template(
         "dashboard.html",
         user_data=user_data,
@@ -409,34 +864,22 @@ def dashboard():
 
 @app.route("/pricing")
 def pricing():
-    # Initialize default values for non-logged in users
-    current_plan = "free"
-    plan_data = {"plan": "free"}
-    is_authenticated = "user" in session
-
-    # If user is logged in, get their plan data
-    if is_authenticated:
-        user_id = session["user"]["uid"]
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-
-        if not user_doc.exists:
-            initialize_new_user(user_id)
-            user_doc = user_ref.get()
-
-        user_data = user_doc.to_dict()
-        current_plan = user_data.get("subscription", {}).get("plan", "free")
-        plan_data = user_data.get("subscription", {"plan": "free"})
+    # Free plan defaults for logged-out users, as on terms and privacy
+    plan_data = load_plan_data()
 
     return render_template(
         "pricing.html",
-        plans=SUBSCRIPTION_PLANS,
-        current_plan=current_plan,
+        current_plan=plan_data.get("plan", "free"),
         plan_data=plan_data,
-        is_authenticated=is_authenticated,
     )
 
 
+# extract_video_info responses by video_id. Title, thumbnail and length don't change,
+# so a video pasted again (by anyone) skips both Firestore and the YouTube API.
+VIDEO_INFO_CACHE = TTLCache(maxsize=5000, ttl=3600)
+VIDEO_INFO_CACHE_LOCK = threading.Lock()
+
+
 @app.route("/api/extract-video-info", methods=["POST"])
 @auth_required
 def extract_video_info():
@@ -444,34 +887,58 @@ def extract_video_info():
     video_url = data.get("video_url", "")
 
     if not video_url:
-        return jsonify({"error": "No video URL provided"}), 400
+        return error_response("No video URL provided", 400)
 
     try:
         video_id = extract_video_id(video_url)
         if not video_id:
-            return jsonify({"error": "Invalid YouTube URL"}), 400
-
-        # Get video details from YouTube API
-        api_key = os.getenv("YOUTUBE_API_KEY")
-        video_details_url = f"https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={api_key}&part=snippet,contentDetails"
-        response = requests.get(video_details_url)
-        video_data = response.json()
-
-        if not video_data.get("items"):
-            return jsonify({"error": "Video not found or unavailable"}), 404
+            return error_response("Invalid YouTube URL", 400)
+
+        with VIDEO_INFO_CACHE_LOCK:
+            video_info = VIDEO_INFO_CACHE.get(video_id)
+        if video_info is not None:
+            return jsonify(video_info)
+
+        # Videos that were already summarized have their metadata stored, so only
+        # fall back to the YouTube API for new ones
+        cached = (
+            get_db()
+            .collection("videos")
+            .document(video_id)
+            .get(field_paths=["title", "thumbnail_url", "video_length"])
+        )
+        cached_data = cached.to_dict() if cached.exists else {}
+        if (cached_data.get("video_length") or 0) > 0 and cached_data.get("thumbnail_url"):
+            duration = cached_data["video_length"]
+            video_info = {
+                "video_id": video_id,
+                "title": cached_data.get("title", "Untitled"),
+                "thumbnail": cached_data["thumbnail_url"],
+                "duration_seconds": duration,
+                "duration_minutes": round(duration / 60, 2),
+            }
+        else:
+            # Get video details from YouTube API
+            video_details_url = f"https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={YOUTUBE_API_KEY}&part=snippet,contentDetails"
+            response = youtube_http.get(video_details_url, timeout=(3, 5))
+            video_data = response.json()
 
-        video_info = video_data["items"][0]
-        duration = parse_duration(video_info["contentDetails"]["duration"])
+            if not video_data.get("items"):
+                return error_response("Video not found or unavailable", 404)
 
-        return jsonify(
-            {
+            item = video_data["items"][0]
+            duration = parse_duration(item["contentDetails"]["duration"])
+            video_info = {
                 "video_id": video_id,
-                "title": video_info["snippet"]["title"],
-                "thumbnail": video_info["snippet"]["thumbnails"]["high"]["url"],
+                "title": item["snippet"]["title"],
+                "thumbnail": item["snippet"]["thumbnails"]["high"]["url"],
                 "duration_seconds": duration,
                 "duration_minutes": round(duration / 60, 2),
             }
-        )
+
+        with VIDEO_INFO_CACHE_LOCK:
+            VIDEO_INFO_CACHE[video_id] = video_info
+        return jsonify(video_info)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -481,36 +948,16 @@ def extract_video_info():
 @auth_required
 def get_user_usage():
     user_id = session["user"]["uid"]
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        initialize_new_user(user_id)
-        user_doc = user_ref.get()
-
-    user_data = user_doc.to_dict()
-
-    usage_data = {
-        "plan": user_data.get("subscription", {}).get("plan", "free"),
-        "minutes_used": user_data.get("usage", {}).get("minutes_used_this_month", 0),
-        "minutes_limit": SUBSCRIPTION_PLANS[
-            user_data.get("subscription", {}).get("plan", "free")
-        ]["minutes_limit"],
-        "next_billing_date": user_data.get("subscription", {})
-        .get("next_billing_date", datetime.now())
-        .strftime("%B %d, %Y"),
-        "video_count": len(user_data.get("usage", {}).get("video_history", [])),
-        "percentage_used": round(
-            (
-                user_data.get("usage", {}).get("minutes_used_this_month", 0)
-                / SUBSCRIPTION_PLANS[
-                    user_data.get("subscription", {}).get("plan", "free")
-                ]["minutes_limit"]
-            )
-            * 100,
-            1,
-        ),
-    }
+    _, user_data = get_user_fields(
+        user_id,
+        [
+            "subscription.plan",
+            "subscription.next_billing_date",
+            "usage.minutes_used_this_month",
+        ],
+    )
+    usage_data = build_plan_data(user_data)
+    usage_data["video_count"] = user_data.get("usage", {}).get("video_count", 0)
 
     return jsonify(usage_data)
 
@@ -519,17 +966,10 @@ def get_user_usage():
 @auth_required
 def get_recent_videos():
     user_id = session["user"]["uid"]
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        return jsonify([]), 200
-
-    user_data = user_doc.to_dict()
-    video_history = user_data.get("usage", {}).get("video_history", [])
+    get_user_fields(user_id, [])  # Migrates any legacy history into the subcollection
 
     # Return the 10 most recent videos
-    return jsonify(video_history[:10])
+    return jsonify(get_video_history(user_id, 10))
 
 
 # Razorpay Integration
@@ -541,7 +981,7 @@ def create_subscription():
     user_country = request.headers.get('X-User-Country', 'US')  # Get user's country from frontend
 
     if not plan_id or plan_id not in SUBSCRIPTION_PLANS:
-        return jsonify({"error": "Invalid plan selected"}), 400
+        return error_response("Invalid plan selected", 400)
 
     if plan_id == "free":
         # Handle free plan subscription
@@ -575,7 +1015,8 @@ def create_subscription():
                 "currency": order_currency,
                 "receipt": order_receipt,
                 "notes": notes,
-            }
+            },
+            timeout=RAZORPAY_TIMEOUT,
         )
 
         # Always return display amount in USD
@@ -614,7 +1055,7 @@ def verify_payment():
     plan_id = data.get("plan_id")
 
     if not all([razorpay_payment_id, razorpay_order_id, razorpay_signature, plan_id]):
-        return jsonify({"error": "Missing payment verification details"}), 400
+        return error_response("Missing payment verification details", 400)
 
     try:
         # Verify the payment signature
@@ -637,43 +1078,62 @@ def verify_payment():
         )
 
     except razorpay.errors.SignatureVerificationError:
-        return jsonify({"error": "Invalid payment signature"}), 400
+        return error_response("Invalid payment signature", 400)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+MY_VIDEOS_PAGE_SIZE = 24
+
+
 @app.route("/my-videos")
 @auth_required
 def my_videos():
     user_id = session["user"]["uid"]
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        initialize_new_user(user_id)
-        user_doc = user_ref.get()
-
-    user_data = user_doc.to_dict()
-    video_history = user_data.get("usage", {}).get("video_history", [])
+    _, user_data = get_user_fields(user_id, ["subscription"])
     plan_data = user_data.get("subscription", {"plan": "free"})
 
+    before = request.args.get("before")
+    try:
+        before = datetime.fromisoformat(before) if before else None
+    except ValueError:
+        before = None
+    videos = get_video_history(user_id, MY_VIDEOS_PAGE_SIZE, before)
+    next_before = None
+    if len(videos) == MY_VIDEOS_PAGE_SIZE:
+        next_before = videos[-1]["processed_at"].isoformat()
+
     return render_template(
         "my_videos.html",
-        videos=video_history,
+        videos=videos,
+        next_before=next_before,
         plan_data=plan_data,
         plans=SUBSCRIPTION_PLANS,
     )
 
 
+# Everything get_video_details returns or checks; video documents also hold the full
+# transcript, which the details view never needs
+VIDEO_DETAIL_FIELDS = [
+    "user_id",
+    "title",
+    "summary",
+    "status",
+    "channel_name",
+    "thumbnail_url",
+    "video_length",
+]
+
+
 @app.route("/api/video-details/<video_id>")
 @auth_required
 def get_video_details(video_id):
     user_id = session["user"]["uid"]
     
-    # First check the videos collection directly
-    video_ref = db.collection("videos").document(video_id)
-    video_doc = video_ref.get()
+    # First check the videos collection directly, without its (large) transcript
+    video_ref = get_db().collection("videos").document(video_id)
+    video_doc = video_ref.get(field_paths=VIDEO_DETAIL_FIELDS)
     
     if video_doc.exists:
         video_data = video_doc.to_dict()
@@ -690,149 +1150,183 @@ def get_video_details(video_id):
             })
     
     # Fallback: check user's video history
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-
-    if not user_doc.exists:
-        return jsonify({"error": "User not found"}), 404
-
-    user_data = user_doc.to_dict()
-    video_history = user_data.get("usage", {}).get("video_history", [])
-
-    for video in video_history:
-        if video.get("video_id") == video_id:
-            return jsonify(video)
+    history_doc = (
+        get_db()
+        .collection("users")
+        .document(user_id)
+        .collection("videos")
+        .document(video_id)
+        .get()
+    )
+    if history_doc.exists:
+        return jsonify(history_doc.to_dict())
 
     return jsonify({"error": "Video not found", "status": "processing"}), 404
 
 
-import asyncio
-import traceback
-
 @app.route("/summarize", methods=["POST"])
 @auth_required
 @plan_checker
 def summarize_video():
     """Handle video summarization"""
-    logger.info("="*80)
     logger.info("=== /summarize endpoint called ===")
-    logger.info(f"Request data: {request.get_data()}")
-    print("\n=== /summarize endpoint called ===", flush=True)
-    print(f"Request data: {request.get_data()}", flush=True)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request data: %s", request.get_data())
     
     try:
         data = request.get_json()
         video_url = data.get("video_url")
-        print(f"Processing video URL: {video_url}")
+        logger.info("Processing video URL: %s", video_url)
         
         if not video_url:
-            print("Error: No video URL provided")
-            return jsonify({"error": "Video URL is required"}), 400
+            logger.warning("No video URL provided")
+            return error_response("Video URL is required", 400)
             
         # Get user info
         user_id = session["user"]["uid"]
-        print(f"Processing request for user: {user_id}")
+        logger.info("Processing request for user: %s", user_id)
         
         # Run the async function
-        return asyncio.run(process_video_summary(video_url, user_id))
+        return run_async(process_video_summary(video_url, user_id))
         
     except Exception as e:
-        error_msg = f"Error in summarize_video: {str(e)}"
-        print(error_msg)
-        print(traceback.format_exc())
-        return jsonify({"error": "An error occurred while processing your request"}), 500
+        logger.error("Error in summarize_video: %s", e, exc_info=True)
+        return error_response("An error occurred while processing your request", 500)
 
 async def process_video_summary(video_url, user_id):
     """Async function to process video summary with detailed logging"""
-    print(f"\n--- Starting process_video_summary ---")
-    print(f"Video URL: {video_url}")
-    print(f"User ID: {user_id}")
+    logger.info("--- Starting process_video_summary: %s for user %s ---", video_url, user_id)
     
     try:
-        # Get user data (synchronous operation)
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()  # This is synchronous
-        
-        if not user_doc.exists:
-            print(f"Error: User {user_id} not found")
-            return jsonify({"error": "User not found"}), 404
-            
-        user_data = user_doc.to_dict()
-        print(f"User data retrieved - Plan: {user_data.get('subscription', {}).get('plan', 'free')}")
-        
         # Extract video ID
         video_id = extract_video_id(video_url)
         if not video_id:
-            print(f"Error: Could not extract video ID from URL: {video_url}")
-            return jsonify({"error": "Invalid YouTube URL"}), 400
+            logger.warning("Could not extract video ID from URL: %s", video_url)
+            return error_response("Invalid YouTube URL", 400)
             
-        print(f"Extracted video ID: {video_id}")
+        logger.info("Extracted video ID: %s", video_id)
         
-        # Check if we already have this video in progress/completed
-        video_ref = db.collection("videos").document(video_id)
-        video_doc = video_ref.get()  # This is synchronous
+        # Get user data and check if we already have this video in progress/completed,
+        # both in one round trip
+        user_ref = get_db().collection("users").document(user_id)
+        video_ref = get_db().collection("videos").document(video_id)
+        # Firestore calls are blocking; run them off the shared event loop so other
+        # requests' OpenAI calls keep making progress meanwhile
+        if "usage" in g:
+            # plan_checker already has this user's plan and minutes
+            usage_minutes, plan_type = g.usage
+            video_doc = await asyncio.to_thread(
+                video_ref.get, field_paths=["status", "summary", "webhook_received_at"]
+            )
+        else:
+            user_doc, video_doc = await asyncio.to_thread(get_documents, user_ref, video_ref)
+
+            if not user_doc.exists:
+                logger.warning("User %s not found", user_id)
+                return error_response("User not found", 404)
+
+            user_data = user_doc.to_dict()
+            plan_type = user_data.get("subscription", {}).get("plan", "free")
+            usage_minutes = user_data.get("usage", {}).get("minutes_used_this_month", 0)
+        logger.info("User data retrieved - Plan: %s", plan_type)
         
         if video_doc.exists:
             video_data = video_doc.to_dict()
-            print(f"Found existing video data: {video_data}")
+            logger.info("Found existing video %s with status %s", video_id, video_data.get("status"))
             
             if video_data.get('status') == 'completed':
-                print("Video already processed, returning existing summary")
+                logger.info("Video already processed, returning existing summary")
                 return jsonify({
                     "status": "completed",
                     "video_id": video_id,
                     "summary": video_data.get('summary')
                 })
             elif video_data.get('status') == 'processing':
-                print("Video is already being processed")
-                return jsonify({
-                    "status": "processing",
-                    "video_id": video_id,
-                    "message": "Video is being processed. Please check back soon!"
-                })
+                if not is_stuck_webhook_video(video_data):
+                    logger.info("Video is already being processed")
+                    return jsonify({
+                        "status": "processing",
+                        "video_id": video_id,
+                        "message": "Video is being processed. Please check back soon!"
+                    })
+                logger.warning("Video %s was never summarized after its webhook arrived, starting over", video_id)
         
+        # A failed or stuck video still has the delivery the webhook saved
+        has_delivery = video_doc.exists and video_data.get('webhook_received_at') is not None
+
         # Check user's plan limits
-        plan_type = user_data.get("subscription", {}).get("plan", "free")
-        usage_minutes = user_data.get("usage", {}).get("minutes_used_this_month", 0)
-        plan_limit = SUBSCRIPTION_PLANS[plan_type]["minutes_limit"]
+        plan_limit = PLAN_LIMITS[plan_type]
         
-        print(f"Plan check - Type: {plan_type}, Used: {usage_minutes}min, Limit: {plan_limit}min")
+        logger.info("Plan check - Type: %s, Used: %smin, Limit: %smin", plan_type, usage_minutes, plan_limit)
         
         if usage_minutes >= plan_limit:
-            print("Error: User has exceeded plan limit")
+            logger.warning("User has exceeded plan limit")
             return jsonify({
                 "error": "Plan limit exceeded",
                 "message": "You've reached your monthly minute limit. Please upgrade your plan."
             }), 403
         
+        if has_delivery:
+            # Finish it the way the webhook would have, with the metadata saved
+            # alongside the transcript
+            logger.info("Resuming video %s from its saved webhook delivery", video_id)
+            stored_data = (await asyncio.to_thread(video_ref.get)).to_dict()
+            await asyncio.to_thread(video_ref.update, {
+                'status': 'processing',
+                'user_id': user_id,
+                'updated_at': firestore.SERVER_TIMESTAMP,
+                'webhook_received_at': firestore.SERVER_TIMESTAMP,  # Restarts the stale clock
+            })
+            with VIDEO_OWNER_CACHE_LOCK:
+                VIDEO_OWNER_CACHE[video_id] = user_id
+            webhook_executor.submit(
+                run_with_app_context,
+                process_webhook_video,
+                video_id,
+                webhook_video_data(stored_data),
+                stored_data.get('transcript', ''),
+            )
+            return jsonify({
+                "status": "processing",
+                "video_id": video_id,
+                "message": "Video is being processed. Please check back soon!"
+            })
+
         # Mark video as processing
-        print("Marking video as processing in database...")
-        video_ref.set({
+        logger.info("Marking video as processing in database...")
+        await asyncio.to_thread(video_ref.set, {
             'status': 'processing',
             'created_at': firestore.SERVER_TIMESTAMP,
             'user_id': user_id,
             'video_url': f"https://www.youtube.com/watch?v={video_id}",
             'title': 'Processing...',
             'channel': 'Processing...',
-            'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
+            'thumbnail': f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg",
+            'webhook_received_at': firestore.DELETE_FIELD,  # Set again by the next delivery
         }, merge=True)
+        with VIDEO_OWNER_CACHE_LOCK:
+            VIDEO_OWNER_CACHE[video_id] = user_id
         
         # Trigger transcript extraction
-        print("Starting transcript extraction...")
+        logger.info("Starting transcript extraction...")
         transcript, message = await get_video_transcript(video_id)
         
         if transcript:
             # This branch shouldn't normally be hit with Bright Data
-            print("Got transcript immediately (unexpected with Bright Data)")
-            summary = await generate_summary(
-                transcript,
+            logger.info("Got transcript immediately (unexpected with Bright Data)")
+            summary = await get_or_compute_summary(
+                video_id,
                 plan_type,
-                "Video Title",
-                "Channel Name"
+                lambda: generate_summary(
+                    transcript,
+                    plan_type,
+                    "Video Title",
+                    "Channel Name"
+                ),
             )
             
             # Update video in database
-            print("Updating video with completed summary...")
+            logger.info("Updating video with completed summary...")
             video_data = {
                 'status': 'completed',
                 'summary': summary,
@@ -840,7 +1334,7 @@ async def process_video_summary(video_url, user_id):
                 'title': "Video Title",
                 'channel': "Channel Name"
             }
-            db.collection("videos").document(video_id).set(video_data, merge=True)
+            await asyncio.to_thread(video_ref.set, video_data, merge=True)
             log_memory_usage("Processing complete")
             return jsonify({
                 "status": "success",
@@ -861,7 +1355,7 @@ async def process_video_summary(video_url, user_id):
 def bright_data_webhook():
     """Handle incoming webhooks from Bright Data"""
     logger.info("--- BRIGHT DATA WEBHOOK RECEIVED ---")
-    logger.info(f"Headers: {dict(request.headers)}")
+    logger.info("Headers: %s", dict(request.headers))
     
     try:
         # Verify webhook is from Bright Data
@@ -871,18 +1365,22 @@ def bright_data_webhook():
         
         # Verify it's from Bright Data
         if 'BRD' not in user_agent and 'bright' not in user_agent.lower():
-            logger.warning(f"⚠️ Suspicious webhook - User-Agent doesn't match Bright Data: {user_agent}")
-            return jsonify({"status": "error", "message": "Invalid webhook source"}), 401
+            logger.warning("⚠️ Suspicious webhook - User-Agent doesn't match Bright Data: %s", user_agent)
+            return Response(INVALID_WEBHOOK_SOURCE_BODY, status=401, mimetype="application/json")
         
-        logger.info(f"✅ Verified Bright Data webhook - User-Agent: {user_agent}, Snapshot-ID: {snapshot_id}")
+        logger.info("✅ Verified Bright Data webhook - User-Agent: %s, Snapshot-ID: %s", user_agent, snapshot_id)
             
         # Parse and validate the webhook data
         try:
             payload = request.get_json()
-            logger.info(f"Received webhook payload: {json.dumps(payload, indent=2)}")
+            # Payloads carry the full transcript; only serialize them for debugging
+            debug_logging = logger.isEnabledFor(logging.DEBUG)
+            if debug_logging:
+                logger.debug("Received webhook payload: %s", json.dumps(payload))
             
             parsed_data = BrightDataService.parse_webhook_data(payload)
-            logger.info(f"Parsed webhook data: {json.dumps(parsed_data, indent=2, default=str)}")
+            if debug_logging:
+                logger.debug("Parsed webhook data: %s", json.dumps(parsed_data, default=str))
             
             if not parsed_data.get('valid'):
                 error_msg = f"Invalid webhook data: {parsed_data.get('error')}"
@@ -895,105 +1393,28 @@ def bright_data_webhook():
                 logger.error(error_msg)
                 return jsonify({"status": "error", "message": error_msg}), 400
             
-            logger.info(f"Processing webhook for video: {video_id}")
-            
-            # Prepare video data for update
-            video_data = {
-                'title': parsed_data.get('title', 'Untitled'),
-                'video_length': parsed_data.get('video_length', 0),
-                'thumbnail_url': parsed_data.get('thumbnail_url', ''),
-                'published_at': parsed_data.get('published_at', firestore.SERVER_TIMESTAMP),
-                'channel_name': parsed_data.get('channel_name', ''),
-                'channel_avatar': parsed_data.get('channel_avatar', ''),
-                'channel_url': parsed_data.get('channel_url', ''),
-                'view_count': parsed_data.get('view_count', 0),
-                'like_count': parsed_data.get('like_count', 0),
-                'subscriber_count': parsed_data.get('subscriber_count', 0),
-                'transcript': parsed_data.get('transcript', ''),
-                'quality': parsed_data.get('quality', 'standard'),
-                'description': parsed_data.get('description', ''),
-                'status': 'completed',
-                'updated_at': firestore.SERVER_TIMESTAMP,
-                'processing_completed_at': firestore.SERVER_TIMESTAMP
-            }
-            
-            # Get the video document to find the user who requested it
-            video_ref = db.collection("videos").document(video_id)
-            video_doc = video_ref.get()
-            
-            if video_doc.exists:
-                video_data['user_id'] = video_doc.to_dict().get('user_id')
-                logger.info(f"Found existing video document for user: {video_data['user_id']}")
-                
-                # Get user's plan type
-                user_ref = db.collection('users').document(video_data['user_id'])
-                user_doc = user_ref.get()
-                
-                if user_doc.exists:
-                    user_data = user_doc.to_dict()
-                    # Get plan from subscription object, not directly from user_data
-                    plan_type = user_data.get('subscription', {}).get('plan', 'free')
-                    
-                    # Generate summary if transcript exists
-                    transcript = parsed_data.get('transcript', '')
-                    if transcript:
-                        try:
-                            logger.info(f"Generating summary for video: {video_id}")
-                            summary = generate_summary(
-                                transcript=transcript,
-                                plan_type=plan_type,
-                                title=video_data.get('title', ''),
-                                channel=video_data.get('channel_name', '')
-                            )
-                            video_data['summary'] = summary
-                            logger.info(f"Successfully generated summary for video: {video_id}")
-                        except Exception as e:
-                            error_msg = f"Error generating summary: {str(e)}"
-                            logger.error(error_msg, exc_info=True)
-                            video_data['summary'] = "Error generating summary. Please try again later."
-                else:
-                    logger.warning(f"User document not found for user_id: {video_data.get('user_id')}")
-            else:
-                logger.warning(f"⚠️ No existing video document found for video_id: {video_id}")
-                logger.warning("Webhook received but video was not previously submitted. This might be a test webhook.")
-                print(f"\n⚠️ WARNING: Webhook received for video {video_id} but no video document exists in DB!")
-                print("This means the video was never submitted through the /summarize endpoint.\n", flush=True)
-                # Don't update user usage if video doc doesn't exist - we don't know which user to update
-            
-            # Save to database
-            logger.info(f"Updating video document in Firestore: {video_id}")
-            video_ref.set(video_data, merge=True)
-            
-            # Update user usage - CRITICAL: This adds video to user's history and updates duration bar
-            if 'user_id' in video_data and video_data.get('user_id') and 'video_length' in video_data and video_data.get('video_length', 0) > 0:
-                try:
-                    duration_minutes = video_data['video_length'] / 60  # Convert seconds to minutes
-                    logger.info(f"Updating user usage: user_id={video_data['user_id']}, duration={duration_minutes}min, video_id={video_id}")
-                    update_user_usage(
-                        user_id=video_data['user_id'],
-                        duration_minutes=duration_minutes,
-                        video_id=video_id,
-                        title=video_data.get('title', 'Untitled'),
-                        summary=video_data.get('summary', '')
-                    )
-                    logger.info(f"✅ Successfully updated usage for user: {video_data['user_id']}")
-                except Exception as e:
-                    error_msg = f"❌ Error updating user usage: {str(e)}"
-                    logger.error(error_msg, exc_info=True)
-                    print(f"\n{error_msg}\n")
-            else:
-                missing = []
-                if 'user_id' not in video_data or not video_data.get('user_id'):
-                    missing.append('user_id')
-                if 'video_length' not in video_data or not video_data.get('video_length', 0):
-                    missing.append('video_length')
-                logger.warning(f"⚠️ Cannot update user usage - missing: {missing}")
-                print(f"\n⚠️ WARNING: Cannot update user usage - missing fields: {missing}\n")
-            
-            
-            logger.info(f"Successfully processed webhook for video: {video_id}")
-            log_memory_usage("Processing complete")
-            return jsonify({"status": "success"})
+            logger.info("Processing webhook for video: %s", video_id)
+            # Bright Data won't retry after a 202, so save the delivery first: if this
+            # process stops before the summary is done, the video stays 'processing'
+            # with webhook_received_at set and the next /summarize for it starts over
+            video_data = webhook_video_data(parsed_data)
+            transcript = parsed_data.get('transcript', '')
+            get_db().collection("videos").document(video_id).set(
+                {
+                    **video_data,
+                    'transcript': transcript,
+                    'status': 'processing',
+                    'updated_at': firestore.SERVER_TIMESTAMP,
+                    'webhook_received_at': firestore.SERVER_TIMESTAMP,
+                },
+                merge=True,
+            )
+            # Summaries take up to a couple of minutes; acknowledge the delivery now so
+            # Bright Data doesn't time out and retry, and finish in the background
+            webhook_executor.submit(
+                run_with_app_context, process_webhook_video, video_id, video_data, transcript
+            )
+            return jsonify({"status": "accepted"}), 202
             
         except json.JSONDecodeError as je:
             error_msg = f"Invalid JSON payload: {str(je)}"
@@ -1006,30 +1427,193 @@ def bright_data_webhook():
         return jsonify({"status": "error", "message": error_msg}), 500
 
 
-@app.route("/api/test/logging", methods=["GET"])
+# user_id per video_id as written to the "processing" video document, so the webhook
+# usually doesn't need to read it back. Deliveries normally arrive within minutes.
+VIDEO_OWNER_CACHE = TTLCache(maxsize=10000, ttl=3600)
+VIDEO_OWNER_CACHE_LOCK = threading.Lock()
+
+# Webhook deliveries are processed here after the route has answered. Two workers
+# keep OpenAI load bounded; more deliveries simply queue.
+webhook_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhook")
+
+# Summaries finish within a few minutes of the delivery (chunk calls time out after a
+# minute); one still 'processing' after this was lost with the process that had it
+WEBHOOK_STALE_AFTER = timedelta(minutes=15)
+
+
+def is_stuck_webhook_video(video_data):
+    """Whether a 'processing' video got its transcript but was never summarized"""
+    received_at = video_data.get('webhook_received_at')
+    return received_at is not None and datetime.now(timezone.utc) - received_at > WEBHOOK_STALE_AFTER
+
+
+def run_with_app_context(fn, *args):
+    """Run fn(*args) inside an app context (for get_db and g), logging any failure"""
+    with app.app_context():
+        try:
+            fn(*args)
+        except Exception:
+            logger.error("Error in background task %s", fn.__name__, exc_info=True)
+
+
+def webhook_video_data(parsed_data):
+    """Video document fields from a parsed delivery, apart from its transcript"""
+    return {
+        'title': parsed_data.get('title', 'Untitled'),
+        'video_length': parsed_data.get('video_length', 0),
+        'thumbnail_url': parsed_data.get('thumbnail_url', ''),
+        'published_at': parsed_data.get('published_at', firestore.SERVER_TIMESTAMP),
+        'channel_name': parsed_data.get('channel_name', ''),
+        'channel_avatar': parsed_data.get('channel_avatar', ''),
+        'channel_url': parsed_data.get('channel_url', ''),
+        'view_count': parsed_data.get('view_count', 0),
+        'like_count': parsed_data.get('like_count', 0),
+        'subscriber_count': parsed_data.get('subscriber_count', 0),
+        'quality': parsed_data.get('quality', 'standard'),
+        'description': parsed_data.get('description', ''),
+    }
+
+
+def process_webhook_video(video_id, video_data, transcript):
+    """Summarize a delivered transcript and record it on the video and its user.
+
+    Marks the video 'failed' if that doesn't finish, so the user can submit it again.
+    """
+    try:
+        complete_webhook_video(video_id, video_data, transcript)
+    except Exception:
+        get_db().collection("videos").document(video_id).update(
+            {'status': 'failed', 'updated_at': firestore.SERVER_TIMESTAMP}
+        )
+        raise
+
+
+def complete_webhook_video(video_id, video_data, transcript):
+    # The delivery itself (metadata and transcript) was saved by the webhook route
+    video_data = {
+        **video_data,
+        'status': 'completed',
+        'updated_at': firestore.SERVER_TIMESTAMP,
+        'processing_completed_at': firestore.SERVER_TIMESTAMP
+    }
+
+    # Find the user who requested the video, from this process's record of the
+    # submission if it has one, otherwise from the video document
+    video_ref = get_db().collection("videos").document(video_id)
+    with VIDEO_OWNER_CACHE_LOCK:
+        owner_id = VIDEO_OWNER_CACHE.pop(video_id, None)
+    if owner_id is None:
+        video_doc = video_ref.get(field_paths=["user_id"])
+        if video_doc.exists:
+            owner_id = video_doc.to_dict().get('user_id')
+
+    if owner_id is not None:
+        video_data['user_id'] = owner_id
+        logger.info("Found existing video document for user: %s", video_data['user_id'])
+
+        # Get user's plan type. The user doc can't be fetched together with the
+        # video doc (its id comes from there), but plan_checker has usually cached
+        # the plan when the video was submitted.
+        with USAGE_CACHE_LOCK:
+            cached_usage = USAGE_CACHE.get(video_data['user_id'])
+        if cached_usage is not None:
+            plan_type = cached_usage[1]
+        else:
+            user_ref = get_db().collection('users').document(video_data['user_id'])
+            user_doc = user_ref.get(field_paths=["subscription.plan"])
+            # Get plan from subscription object, not directly from user_data
+            plan_type = (
+                user_doc.to_dict().get('subscription', {}).get('plan', 'free')
+                if user_doc.exists
+                else None
+            )
+
+        if plan_type is not None:
+            # Generate summary if transcript exists
+            if transcript:
+                try:
+                    logger.info("Generating summary for video: %s", video_id)
+                    summary = run_async(get_or_compute_summary(
+                        video_id,
+                        plan_type,
+                        lambda: generate_summary(
+                            transcript=transcript,
+                            plan_type=plan_type,
+                            title=video_data.get('title', ''),
+                            channel=video_data.get('channel_name', '')
+                        ),
+                    ))
+                    video_data['summary'] = summary
+                    logger.info("Successfully generated summary for video: %s", video_id)
+                except Exception as e:
+                    error_msg = f"Error generating summary: {str(e)}"
+                    logger.error(error_msg, exc_info=True)
+                    video_data['summary'] = "Error generating summary. Please try again later."
+        else:
+            logger.warning("User document not found for user_id: %s", video_data.get('user_id'))
+    else:
+        logger.warning("⚠️ No existing video document found for video_id: %s", video_id)
+        logger.warning("Webhook received but video was not previously submitted. This might be a test webhook.")
+        # Don't update user usage if video doc doesn't exist - we don't know which user to update
+
+    # Update user usage - CRITICAL: This adds video to user's history and updates duration bar
+    if 'user_id' in video_data and video_data.get('user_id') and 'video_length' in video_data and (video_data.get('video_length') or 0) > 0:
+        try:
+            duration_minutes = video_data['video_length'] / 60  # Convert seconds to minutes
+            logger.info("Updating user usage: user_id=%s, duration=%smin, video_id=%s", video_data['user_id'], duration_minutes, video_id)
+            update_user_usage(
+                user_id=video_data['user_id'],
+                duration_minutes=duration_minutes,
+                video_id=video_id,
+                title=video_data.get('title', 'Untitled'),
+                summary=video_data.get('summary', ''),
+                video_data=video_data,  # Saved in the same batch as the usage
+            )
+            logger.info("✅ Successfully updated usage for user: %s", video_data['user_id'])
+        except Exception as e:
+            error_msg = f"❌ Error updating user usage: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            # Still save the transcript and summary
+            logger.info("Updating video document in Firestore: %s", video_id)
+            video_ref.set(video_data, merge=True)
+    else:
+        # Save to database
+        logger.info("Updating video document in Firestore: %s", video_id)
+        video_ref.set(video_data, merge=True)
+
+        missing = []
+        if 'user_id' not in video_data or not video_data.get('user_id'):
+            missing.append('user_id')
+        if 'video_length' not in video_data or not video_data.get('video_length', 0):
+            missing.append('video_length')
+        logger.warning("⚠️ Cannot update user usage - missing: %s", missing)
+
+    logger.info("Successfully processed webhook for video: %s", video_id)
+    log_memory_usage("Processing complete")
+
+
 def test_logging():
     """Test endpoint to verify logging works in Railway"""
     logger.info("="*80)
     logger.info("TEST LOGGING ENDPOINT CALLED")
     logger.info("="*80)
-    print("="*80, flush=True)
-    print("TEST LOGGING ENDPOINT CALLED", flush=True)
-    print("="*80, flush=True)
     return jsonify({
         "status": "success",
         "message": "If you see this in Railway logs, logging is working!",
         "timestamp": datetime.now().isoformat()
     })
 
-@app.route("/api/debug/video/<video_id>", methods=["GET"])
 @auth_required
 def debug_video(video_id):
     """Debug endpoint to check video status in database"""
     user_id = session["user"]["uid"]
     
-    # Check videos collection
-    video_ref = db.collection("videos").document(video_id)
-    video_doc = video_ref.get()
+    # Read the user first, which migrates any legacy history, then fetch the video
+    # and its history entry in a single round trip
+    user_ref, user_data = get_user_doc(user_id)
+    video_ref = get_db().collection("videos").document(video_id)
+    history_ref = user_ref.collection("videos").document(video_id)
+    video_doc, history_doc = get_documents(video_ref, history_ref)
     
     video_data = None
     if video_doc.exists:
@@ -1041,19 +1625,16 @@ def debug_video(video_id):
                     video_data[key] = value.isoformat()
     
     # Check user's video history
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-    user_data = user_doc.to_dict() if user_doc.exists else None
-    video_history = user_data.get("usage", {}).get("video_history", []) if user_data else []
+    video_count = user_data.get("usage", {}).get("video_count", 0) if user_data else 0
     
-    video_in_history = any(v.get("video_id") == video_id for v in video_history)
+    video_in_history = history_doc.exists
     
     # Check if update_user_usage can be called
     can_update = False
     missing_fields = []
     if video_doc.exists and video_data:
         if video_data.get('user_id') == user_id:
-            if video_data.get('video_length', 0) > 0:
+            if (video_data.get('video_length') or 0) > 0:
                 if video_data.get('status') == 'completed':
                     can_update = True
                 else:
@@ -1074,37 +1655,36 @@ def debug_video(video_id):
         "video_status": video_data.get('status') if video_data else None,
         "video_length": video_data.get('video_length') if video_data else None,
         "video_in_user_history": video_in_history,
-        "user_video_history_count": len(video_history),
+        "user_video_history_count": video_count,
         "can_update_user_usage": can_update,
         "missing_fields_for_update": missing_fields,
-        "video_history": video_history[:5]  # Last 5 videos
+        "video_history": get_video_history(user_id, 5)  # Last 5 videos
     })
 
-@app.route("/api/debug/manual-update/<video_id>", methods=["POST"])
 @auth_required
 def manual_update_video(video_id):
     """Manually trigger update_user_usage for testing"""
     user_id = session["user"]["uid"]
     
-    # Get video document
-    video_ref = db.collection("videos").document(video_id)
-    video_doc = video_ref.get()
+    # Get video document, without the transcript
+    video_ref = get_db().collection("videos").document(video_id)
+    video_doc = video_ref.get(field_paths=["user_id", "video_length", "title", "summary"])
     
     if not video_doc.exists:
-        return jsonify({"error": "Video document not found"}), 404
+        return error_response("Video document not found", 404)
     
     video_data = video_doc.to_dict()
     
     # Verify it belongs to this user
     if video_data.get('user_id') != user_id:
-        return jsonify({"error": "Video does not belong to this user"}), 403
+        return error_response("Video does not belong to this user", 403)
     
     # Check if we have required fields
-    if not video_data.get('video_length', 0) > 0:
-        return jsonify({"error": "Video length not available"}), 400
+    if not (video_data.get('video_length') or 0) > 0:
+        return error_response("Video length not available", 400)
     
     if not video_data.get('title'):
-        return jsonify({"error": "Video title not available"}), 400
+        return error_response("Video title not available", 400)
     
     try:
         duration_minutes = video_data['video_length'] / 60
@@ -1127,18 +1707,32 @@ def manual_update_video(video_id):
         }), 500
 
 
+# Debug endpoints are kept out of the URL map unless explicitly enabled
+if app.debug or os.getenv("ENABLE_DEBUG_ROUTES", "false").lower() == "true":
+    app.add_url_rule("/api/test/logging", view_func=test_logging, methods=["GET"])
+    app.add_url_rule("/api/debug/video/<video_id>", view_func=debug_video, methods=["GET"])
+    app.add_url_rule(
+        "/api/debug/manual-update/<video_id>", view_func=manual_update_video, methods=["POST"]
+    )
+
+
 ############################
 """ Helper functions """
 
 
-# Function to extract YouTube video ID from URL
+# Regular expression for the different YouTube URL formats. The catch-all path before
+# "?v=" is bounded so adversarial URLs cannot make the match backtrack for long.
+_YOUTUBE_URL_MATCH = re.compile(
+    r"(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/"
+    r"(watch\?v=|embed/|v/|shorts/|.{0,200}\?v=)?([^&=%\?]{11})"
+).match
+
+
+# Function to extract YouTube video ID from URL; the same URL is usually sent twice,
+# once for the preview and once to summarize
+@lru_cache(maxsize=1024)
 def extract_video_id(url):
-    # Regular expressions for different YouTube URL formats
-    youtube_regex = (
-        r"(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/"
-        r"(watch\?v=|embed/|v/|shorts/|.+\?v=)?([^&=%\?]{11})"
-    )
-    youtube_match = re.match(youtube_regex, url)
+    youtube_match = _YOUTUBE_URL_MATCH(url)
     return youtube_match.group(6) if youtube_match else None
 
 
@@ -1150,8 +1744,8 @@ async def get_video_transcript(video_id):
     """
     try:
         # First check if we already have this video in our database
-        video_ref = db.collection("videos").document(video_id)
-        video_doc = video_ref.get()
+        video_ref = get_db().collection("videos").document(video_id)
+        video_doc = await asyncio.to_thread(video_ref.get)
         
         if video_doc.exists and "transcript" in video_doc.to_dict():
             # Return existing transcript if available
@@ -1160,37 +1754,51 @@ async def get_video_transcript(video_id):
         # If not in DB, trigger Bright Data extraction
         result = await bright_data_service.trigger_transcript_extraction(video_id)
         if not result.get('success'):
-            logger.error(f"Failed to trigger extraction: {result.get('error')}")
+            logger.error("Failed to trigger extraction: %s", result.get('error'))
             return None, "Failed to start transcript extraction"
             
         return None, "Transcript is being processed. Please try again in a moment."
         
     except Exception as e:
-        logger.error(f"Error in get_video_transcript: {str(e)}")
+        logger.error("Error in get_video_transcript: %s", e)
         return None, f"Error processing transcript: {str(e)}"
 
 
 # Generate summary from transcript
-def generate_summary(transcript, plan_type, title, channel):
-    # Different summary types based on subscription plan
-    if plan_type == "free":
-        system_prompt = """You are an AI assistant that creates comprehensive summaries of YouTube video transcripts.
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """AsyncOpenAI client shared by all summaries, created on first use.
+
+    Its connection pool belongs to the event loop it is first used on, so only call
+    it from coroutines running on the shared event_loop.
+    """
+    return openai.AsyncOpenAI(
+        api_key=openai.api_key,
+        max_retries=2,
+        timeout=httpx.Timeout(120, connect=5),
+        # Room for every chunk of a long transcript to be in flight at once, with the
+        # connections kept alive between summaries
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        ),
+    )
+
+
+# Summary instructions per subscription plan
+SUMMARY_SYSTEM_PROMPTS = {
+    "free": """You are an AI assistant that creates comprehensive summaries of YouTube video transcripts.
         Create a thorough summary that covers all important points in the transcript.
         Don't omit critical information, even for longer videos.
-        Format your response with clear sections and good readability."""
-        max_tokens = 3000  # Increased token count for free tier
-    elif plan_type == "pro":
-        system_prompt = """You are an AI assistant that creates premium structured summaries of YouTube video transcripts.
+        Format your response with clear sections and good readability.""",
+    "pro": """You are an AI assistant that creates premium structured summaries of YouTube video transcripts.
         Format your response with these sections:
         1. SUMMARY: A thorough overview of the video content
         2. KEY POINTS: Comprehensive bullet points of the important information
         3. INSIGHTS: Notable observations or takeaways
         4. ACTIONABLE TIPS: Practical advice from the video
         5. DETAILED NOTES: Section-by-section breakdown of content
-        Use markdown formatting for better readability."""
-        max_tokens = 4000  # Increased token count for pro tier
-    else:  # 'elite'
-        system_prompt = """You are an AI assistant that creates enterprise-grade summaries of YouTube video transcripts.
+        Use markdown formatting for better readability.""",
+    "elite": """You are an AI assistant that creates enterprise-grade summaries of YouTube video transcripts.
         Format your response with these sections:
         1. EXECUTIVE SUMMARY: A concise overview for quick understanding
         2. COMPREHENSIVE BREAKDOWN: Detailed coverage of all major topics
@@ -1199,42 +1807,87 @@ def generate_summary(transcript, plan_type, title, channel):
         5. ACTIONABLE TAKEAWAYS: Practical advice organized by relevance
         6. Q&A SECTION: Anticipated questions and answers based on content
         7. RELATED RESOURCES: Suggestions for further information (if mentioned)
-        Use markdown formatting for optimal readability."""
-        max_tokens = 6000  # Significantly increased token count for elite tier
+        Use markdown formatting for optimal readability.""",
+}
+
+# Upper bound on summary length per plan
+SUMMARY_MAX_TOKENS = {"free": 3000, "pro": 4000, "elite": 6000}
+
+# Summary length budget: at least SUMMARY_MIN_TOKENS, otherwise one output token per
+# SUMMARY_COMPRESSION_RATIO transcript tokens, up to the plan's max_tokens
+SUMMARY_MIN_TOKENS = 800
+SUMMARY_COMPRESSION_RATIO = 2
+
+# gpt-4o and gpt-4o-mini both take 128k tokens. A transcript that fits alongside the
+# prompt and the summary is sent in one call; only longer ones are chunked.
+MODEL_CONTEXT_WINDOW = 128000
+CONTEXT_SAFETY_MARGIN = 1000  # System prompt, title and message framing
+FREE_TRANSCRIPT_TOKENS = 6000  # Free summaries cover the opening of the video only
+MAX_CONCURRENT_CHUNKS = 8  # Chunk summaries in flight at once for one transcript
+
+
+@lru_cache(maxsize=None)
+def get_token_encoding():
+    """Tokenizer for the gpt-4o family, loaded on first use"""
+    return tiktoken.get_encoding("o200k_base")
+
+
+async def generate_summary(transcript, plan_type, title, channel):
+    """Return (summary, complete). complete is False when an OpenAI call failed, and
+    the summary is then an error message or is missing sections."""
+    # Different summary types based on subscription plan
+    system_prompt = SUMMARY_SYSTEM_PROMPTS[plan_type]
+    max_tokens = SUMMARY_MAX_TOKENS[plan_type]
+
+    # Loading the tokenizer (a download outside the Docker image) and encoding a long
+    # transcript would stall every other summary on the shared event loop
+    encoding = await asyncio.to_thread(get_token_encoding)
+    transcript_tokens = await asyncio.to_thread(  # Encoded once
+        encoding.encode, transcript, disallowed_special=()
+    )
+    if plan_type == "free" and len(transcript_tokens) > FREE_TRANSCRIPT_TOKENS:
+        transcript_tokens = transcript_tokens[:FREE_TRANSCRIPT_TOKENS]
+        transcript = encoding.decode(transcript_tokens)
+
+    # The plan values above are ceilings; a short video can't use that many, and
+    # generation time grows with output length
+    max_tokens = min(
+        max_tokens,
+        max(SUMMARY_MIN_TOKENS, len(transcript_tokens) // SUMMARY_COMPRESSION_RATIO),
+    )
 
     # Process transcript in chunks if it's too long
-    def chunk_transcript(text, chunk_size=12000, overlap=2000):
-        """Split transcript into overlapping chunks to preserve context."""
-        if len(text) <= chunk_size:
+    def chunk_transcript(text, tokens, chunk_size=8000, overlap=500):
+        """Split transcript into overlapping chunks of at most chunk_size tokens."""
+        if len(tokens) <= chunk_size:
             return [text]
             
         chunks = []
         start = 0
-        while start < len(text):
-            end = min(start + chunk_size, len(text))
+        while True:
+            end = min(start + chunk_size, len(tokens))
             
-            # Try to find a sentence break to avoid cutting mid-sentence
-            if end < len(text):
-                sentence_breaks = ['.', '!', '?', '\n']
-                for i in range(min(500, end - start), 0, -1):  # Look back up to 500 chars
-                    if text[end - i] in sentence_breaks:
-                        end = end - i + 1  # Include the period
+            # Try to end on a sentence break to avoid cutting mid-sentence
+            if end < len(tokens):
+                for i in range(end - 1, max(start, end - 100) - 1, -1):  # Look back up to 100 tokens
+                    token_bytes = encoding.decode_single_token_bytes(tokens[i]).rstrip(b" ")
+                    if token_bytes.endswith((b".", b"!", b"?", b"\n")):
+                        end = i + 1  # Include the period
                         break
             
-            chunks.append(text[start:end])
+            chunks.append(encoding.decode(tokens[start:end]))
+            if end == len(tokens):
+                break
             start = end - overlap  # Create overlap between chunks
             
         return chunks
 
-    # Process transcript in chunks if needed
-    transcript_chunks = chunk_transcript(transcript)
-    
-    # For single chunks or free tier, process directly
-    if len(transcript_chunks) == 1 or plan_type == "free":
-        prompt = f"Transcript: {transcript_chunks[0]}"
+    # When the whole transcript fits in the context window, process it directly
+    if len(transcript_tokens) + max_tokens + CONTEXT_SAFETY_MARGIN <= MODEL_CONTEXT_WINDOW:
+        prompt = f"Transcript: {transcript}"
         
         try:
-            response = openai.chat.completions.create(
+            response = await get_openai_client().chat.completions.create(
                 model="gpt-4o" if plan_type != "free" else "gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": f"{system_prompt}\n\nVideo Title: {title}\nChannel: {channel}"},
@@ -1244,38 +1897,63 @@ def generate_summary(transcript, plan_type, title, channel):
                 temperature=0.5,
             )
 
-            return response.choices[0].message.content
+            return response.choices[0].message.content, True
         except Exception as e:
-            print(f"Error generating summary: {e}")
-            return "Error generating summary. Please try again later."
+            logger.error("Error generating summary: %s", e)
+            return "Error generating summary. Please try again later.", False
     
     # For longer transcripts on paid tiers, use a multi-pass approach
     else:
-        # First pass: Generate summaries for each chunk
-        chunk_summaries = []
+        transcript_chunks = await asyncio.to_thread(chunk_transcript, transcript, transcript_tokens)
+
+        # First pass: Generate summaries for each chunk, all requests in flight at once
+        # Static instructions first and per-call details last, so requests share the
+        # longest possible prefix for OpenAI's prompt caching
         chunk_system_prompt = f"""Summarize this portion of a transcript comprehensively.
-        Video: {title} by {channel}
         Don't conclude or wrap up - this is just one part of a longer transcript.
-        Maintain all key information, including specific details, numbers, and technical terms."""
+        Maintain all key information, including specific details, numbers, and technical terms.
+        Video: {title} by {channel}"""
         
-        for i, chunk in enumerate(transcript_chunks):
-            try:
-                chunk_prompt = f"This is part {i+1} of {len(transcript_chunks)} of the transcript:\n\n{chunk}"
-                
-                response = openai.chat.completions.create(
-                    model="gpt-4o",
+        # Chunk passes only restate each section, so a smaller model is enough below
+        # elite; gpt-4o is kept for the final synthesis
+        chunk_model = "gpt-4o" if plan_type == "elite" else "gpt-4o-mini"
+        client = get_openai_client()
+        # Very long videos can have dozens of chunks; cap how many are in flight so
+        # one summary doesn't run into the OpenAI rate limit on its own
+        chunk_slots = asyncio.Semaphore(MAX_CONCURRENT_CHUNKS)
+
+        async def summarize_chunk(i, chunk):
+            async with chunk_slots:
+                return await client.chat.completions.create(
+                    model=chunk_model,
                     messages=[
                         {"role": "system", "content": chunk_system_prompt},
-                        {"role": "user", "content": chunk_prompt},
+                        {
+                            "role": "user",
+                            "content": f"{chunk}\n\n(This is part {i+1} of {len(transcript_chunks)} of the transcript.)",
+                        },
                     ],
-                    max_tokens=4000,
+                    max_tokens=2000,
                     temperature=0.3,  # Lower temperature for more factual intermediate summaries
+                    # A 2000-token chunk summary takes well under a minute, so a stalled
+                    # call is given up and retried long before the client-wide 120s
+                    timeout=httpx.Timeout(60, connect=5),
                 )
-                
+
+        responses = await asyncio.gather(
+            *(summarize_chunk(i, chunk) for i, chunk in enumerate(transcript_chunks)),
+            return_exceptions=True,
+        )
+
+        chunk_summaries = []
+        chunks_failed = False
+        for i, response in enumerate(responses):
+            if isinstance(response, Exception):
+                logger.error("Error processing chunk %d: %s", i + 1, response)
+                chunk_summaries.append(f"[Error processing this section of the transcript: {str(response)}]")
+                chunks_failed = True
+            else:
                 chunk_summaries.append(response.choices[0].message.content)
-            except Exception as e:
-                print(f"Error processing chunk {i+1}: {e}")
-                chunk_summaries.append(f"[Error processing this section of the transcript: {str(e)}]")
         
         # Second pass: Combine the summaries into a final, structured result
         combined_summary = "\n\n---\n\n".join(chunk_summaries)
@@ -1283,7 +1961,7 @@ def generate_summary(transcript, plan_type, title, channel):
         final_prompt = f"Below are summaries of different sections of the transcript. Please create a cohesive final summary according to the specified format:\n\n{combined_summary}"
         
         try:
-            response = openai.chat.completions.create(
+            response = await client.chat.completions.create(
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -1293,53 +1971,70 @@ def generate_summary(transcript, plan_type, title, channel):
                 temperature=0.5,
             )
 
-            return response.choices[0].message.content
+            # The final pass smooths over a missing section, so report it explicitly
+            return response.choices[0].message.content, not chunks_failed
         except Exception as e:
-            print(f"Error generating final summary: {e}")
-            return "Error generating comprehensive summary. Please try again later."
+            logger.error("Error generating final summary: %s", e)
+            return "Error generating comprehensive summary. Please try again later.", False
 
 
-# Parse ISO 8601 duration format (PT1H30M15S) to seconds
-def parse_duration(duration):
-    # Remove 'PT' prefix
-    duration = duration[2:]
+# Cached summaries expire after this. Reads check expires_at themselves; a Firestore
+# TTL policy on summary_cache.expires_at (see README) also deletes them.
+SUMMARY_CACHE_TTL = timedelta(days=30)
 
-    hours = 0
-    minutes = 0
-    seconds = 0
 
-    # Extract hours, minutes, seconds
-    hour_match = re.search(r"(\d+)H", duration)
-    minute_match = re.search(r"(\d+)M", duration)
-    second_match = re.search(r"(\d+)S", duration)
+async def get_or_compute_summary(video_id, plan_type, compute):
+    """Return the stored summary for (video_id, plan_type), or await compute() and store it.
+
+    compute() returns (summary, complete), as generate_summary does. Only complete
+    summaries are stored. Summaries depend only on the transcript and the plan's
+    prompt, so repeat requests for the same video and plan skip OpenAI entirely.
+    """
+    cache_ref = get_db().collection("summary_cache").document(f"{video_id}:{plan_type}")
+    cached = await asyncio.to_thread(cache_ref.get, field_paths=["summary", "expires_at"])
+    if cached.exists and cached.get("expires_at") > datetime.now(timezone.utc):
+        logger.info("Summary cache hit for %s (%s)", video_id, plan_type)
+        return cached.get("summary")
+
+    summary, complete = await compute()
+    if complete:
+        await asyncio.to_thread(
+            cache_ref.set,
+            {
+                "summary": summary,
+                "plan_type": plan_type,
+                "created_at": firestore.SERVER_TIMESTAMP,
+                "expires_at": datetime.now(timezone.utc) + SUMMARY_CACHE_TTL,
+            },
+        )
+    return summary
+
+
+_DURATION_MATCH = re.compile(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?").match
 
-    if hour_match:
-        hours = int(hour_match.group(1))
-    if minute_match:
-        minutes = int(minute_match.group(1))
-    if second_match:
-        seconds = int(second_match.group(1))
 
-    return hours * 3600 + minutes * 60 + seconds
+# Parse ISO 8601 duration format (PT1H30M15S) to seconds
+@lru_cache(maxsize=1024)
+def parse_duration(duration):
+    duration_match = _DURATION_MATCH(duration)
+    if not duration_match:
+        return 0
+    days, hours, minutes, seconds = (int(part or 0) for part in duration_match.groups())
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
 
 
 # Update user usage data
-def update_user_usage(user_id, duration_minutes, video_id, title, summary):
-    """Add video to user's history and update usage stats"""
-    logger.info(f"[update_user_usage] Called with: user_id={user_id}, video_id={video_id}, duration={duration_minutes}min")
-    print(f"[update_user_usage] Called with: user_id={user_id}, video_id={video_id}, duration={duration_minutes}min", flush=True)
+def update_user_usage(user_id, duration_minutes, video_id, title, summary, video_data=None):
+    """Add video to user's history and update usage stats.
+
+    If `video_data` is given, it is merged into videos/{video_id} in the same batch.
+    """
+    logger.info("[update_user_usage] Called with: user_id=%s, video_id=%s, duration=%smin", user_id, video_id, duration_minutes)
     
     try:
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-
-        if not user_doc.exists:
-            logger.warning(f"[update_user_usage] User {user_id} not found, initializing...")
-            initialize_new_user(user_id)
-            user_doc = user_ref.get()
+        user_ref = get_db().collection("users").document(user_id)
 
         # Add the video to history and update minutes used
-        # Note: Cannot use SERVER_TIMESTAMP inside ArrayUnion, so use datetime.utcnow() instead
         timestamp = datetime.utcnow()
         
         video_entry = {
@@ -1350,27 +2045,50 @@ def update_user_usage(user_id, duration_minutes, video_id, title, summary):
             "summary": summary or "",
         }
         
-        logger.info(f"[update_user_usage] Video entry being added: {video_entry}")
-        print(f"[update_user_usage] Video entry being added: {video_entry}", flush=True)
-        print(f"[update_user_usage] Video entry keys: {list(video_entry.keys())}", flush=True)
+        logger.debug("[update_user_usage] Video entry being added: %s", video_entry)
 
-        # Update the user document atomically
-        user_ref.update(
-            {
-                "usage.minutes_used_this_month": firestore.Increment(
-                    round(duration_minutes, 2)
-                ),
-                "usage.video_history": firestore.ArrayUnion([video_entry]),
+        # Update usage and write the history entry atomically. Only the history entry is
+        # read: a re-delivered or manually updated video replaces its entry, and must not
+        # count twice. A missing user only shows up as NotFound from the update.
+        history_ref = user_ref.collection("videos").document(video_id)
+
+        @firestore.transactional
+        def record_usage(transaction):
+            usage_update = {
+                "usage.minutes_used_this_month": firestore.Increment(round(duration_minutes, 2)),
             }
-        )
+            if not history_ref.get(field_paths=[], transaction=transaction).exists:
+                usage_update["usage.video_count"] = firestore.Increment(1)
+            transaction.update(user_ref, usage_update)
+            transaction.set(history_ref, video_entry)
+            if video_data is not None:
+                transaction.set(
+                    get_db().collection("videos").document(video_id), video_data, merge=True
+                )
+
+        def commit_usage():
+            record_usage(get_db().transaction())
+
+        try:
+            commit_usage()
+        except NotFound:
+            logger.warning("[update_user_usage] User %s not found, initializing...", user_id)
+            initialize_new_user(user_id)
+            commit_usage()
+        g.pop("user_doc", None)  # The cached copy no longer matches Firestore
+        with USAGE_CACHE_LOCK:
+            cached_usage = USAGE_CACHE.get(user_id)
+            if cached_usage is not None:
+                USAGE_CACHE[user_id] = (
+                    cached_usage[0] + round(duration_minutes, 2),
+                    cached_usage[1],
+                )
         
-        logger.info(f"[update_user_usage] ✅ Successfully updated user {user_id} - added video {video_id} to history")
-        print(f"[update_user_usage] ✅ Successfully updated user {user_id} - added video {video_id} to history", flush=True)
+        logger.info("[update_user_usage] ✅ Successfully updated user %s - added video %s to history", user_id, video_id)
         
     except Exception as e:
         error_msg = f"[update_user_usage] ❌ ERROR: {str(e)}"
         logger.error(error_msg, exc_info=True)
-        print(error_msg, flush=True)
         raise  # Re-raise so caller knows it failed
 
 
@@ -1378,9 +2096,7 @@ def update_user_usage(user_id, duration_minutes, video_id, title, summary):
 def update_user_subscription(user_id, plan_id, payment_id):
     today = datetime.now()
     # Set billing date to the first day of next month
-    next_billing_date = today + relativedelta(
-        months=1, day=1, hour=0, minute=0, second=0, microsecond=0
-    )
+    next_billing_date = first_of_next_month(today.year, today.month)
 
     subscription_data = {
         "plan": plan_id,
@@ -1393,9 +2109,15 @@ def update_user_subscription(user_id, plan_id, payment_id):
         subscription_data["payment_id"] = payment_id
 
     # Update the user's subscription in Firestore
-    user_ref = db.collection("users").document(user_id)
+    user_ref = get_db().collection("users").document(user_id)
     user_ref.update({"subscription": subscription_data})
+    g.pop("user_doc", None)  # The cached copy no longer matches Firestore
+    with USAGE_CACHE_LOCK:
+        USAGE_CACHE.pop(user_id, None)
+    with SUBSCRIPTION_CACHE_LOCK:
+        SUBSCRIPTION_CACHE.pop(user_id, None)
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Local development only; deployments run gunicorn with gunicorn.conf.py
+    app.run(debug=os.getenv("FLASK_DEBUG", "false").lower() == "true", threaded=True)
@@ -11,17 +11,33 @@ class BrightDataService:
         self.api_key = os.getenv('BRIGHT_DATA_API_KEY')
         self.dataset_id = os.getenv('BRIGHT_DATA_DATASET_ID')
         self.base_url = 'https://api.brightdata.com/datasets/v3/trigger'
+        self.webhook_auth_secret = os.getenv('WEBHOOK_AUTH_SECRET', '')
+        self.webhook_url = self._build_webhook_url(os.getenv('API_BASE_URL', 'https://your-production-url.com'))
+        self._client: Optional[httpx.AsyncClient] = None
         
         if not all([self.api_key, self.dataset_id]):
             logger.warning("Bright Data API key or dataset ID not configured")
 
-    def get_webhook_url(self) -> str:
-        """Get the webhook URL for Bright Data callbacks"""
-        base_url = os.getenv('API_BASE_URL', 'https://your-production-url.com')
+    @staticmethod
+    def _build_webhook_url(base_url: str) -> str:
         if not base_url.startswith(('http://', 'https://')):
             base_url = f'https://{base_url}'
         return f"{base_url}/api/webhooks/brightdata"
 
+    def get_webhook_url(self) -> str:
+        """Get the webhook URL for Bright Data callbacks"""
+        return self.webhook_url
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """HTTP client kept for the life of the service, so triggers reuse the TLS connection.
+
+        The client belongs to the event loop it is first used on; the app runs all
+        triggers on its one shared loop.
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        return self._client
+
     async def trigger_transcript_extraction(self, video_id: str) -> Dict[str, Any]:
         """
         Trigger Bright Data to extract transcript for a YouTube video
@@ -47,34 +63,33 @@ class BrightDataService:
             "endpoint": webhook_url,
             "format": "json",
             "uncompressed_webhook": "true",
-            "auth_header": f"Bearer {os.getenv('WEBHOOK_AUTH_SECRET', '')}"
+            "auth_header": f"Bearer {self.webhook_auth_secret}"
         }
         
         request_payload = [{"url": youtube_url}]
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.base_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    params=request_params,
-                    json=request_payload
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                return {
-                    'success': True,
-                    'snapshot_id': result.get('snapshot_id'),
-                    'message': 'Transcript extraction started'
-                }
+            response = await self._get_client().post(
+                self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                params=request_params,
+                json=request_payload
+            )
+            
+            response.raise_for_status()
+            result = response.json()
+            
+            return {
+                'success': True,
+                'snapshot_id': result.get('snapshot_id'),
+                'message': 'Transcript extraction started'
+            }
                 
         except Exception as e:
-            logger.error(f"Error triggering Bright Data extraction: {str(e)}")
+            logger.error("Error triggering Bright Data extraction: %s", e)
             return {
                 'success': False,
                 'error': str(e),